@@ -1,11 +1,86 @@
-from __future__ import division
-
+import functools
 import hmac
 import hashlib
-import sys
+import os
+
+try:
+	# Optional OpenSSL-backed HKDF-Expand, used for the hashes it supports
+	from cryptography.hazmat.backends import default_backend
+	from cryptography.hazmat.primitives import hashes
+	from cryptography.hazmat.primitives.kdf.hkdf import HKDFExpand
+except ImportError:
+	HKDFExpand = None
+
+_HASHES = (hashlib.sha1, hashlib.sha224, hashlib.sha256, hashlib.sha384, hashlib.sha512)
+
+# Digest and block sizes of the common hashlib constructors, so that they can be
+# looked up without instantiating a throwaway hash object on every call
+_DIGEST_SIZES = dict((hash, hash().digest_size) for hash in _HASHES)
+_BLOCK_SIZES = dict((hash, hash().block_size) for hash in _HASHES)
+
+# Default all-zeros salts, shared between calls
+_ZERO_SALTS = dict((hash, bytes(digest_size)) for hash, digest_size in _DIGEST_SIZES.items())
+
+if HKDFExpand is not None:
+	_CRYPTOGRAPHY_HASHES = {
+		hashlib.sha1: hashes.SHA1,
+		hashlib.sha224: hashes.SHA224,
+		hashlib.sha256: hashes.SHA256,
+		hashlib.sha384: hashes.SHA384,
+		hashlib.sha512: hashes.SHA512,
+	}
+else:
+	_CRYPTOGRAPHY_HASHES = {}
+
+# Whether hkdf_expand delegates to cryptography, if it is installed. Off by
+# default since per-call HKDFExpand setup makes it slower than the pure Python
+# loop for short outputs and, with older cryptography releases, for long ones.
+# Set the HKDF_USE_CRYPTOGRAPHY environment variable, or set this to True, to
+# opt in.
+use_cryptography = HKDFExpand is not None and bool(os.environ.get("HKDF_USE_CRYPTOGRAPHY"))
+
+def _cryptography_algorithm(hash):
+	'''Return the cryptography hash class to delegate expansion to, if any'''
+	return _CRYPTOGRAPHY_HASHES.get(hash) if use_cryptography else None
+
+# Single-byte HKDF block counters, prebuilt to avoid an allocation per block
+_CTR8 = tuple(bytes((i,)) for i in range(256))
+
+def _digest_size(hash):
+	return _DIGEST_SIZES.get(hash) or hash().digest_size
 
-if sys.version_info[0] == 3:
-	buffer = lambda x: x
+# HMAC ipad and opad for each known block size as single wide integers, so
+# that padded keys can be XORed in one bigint operation instead of per byte
+_PADS = dict((block_size, (int.from_bytes(b"\x36" * block_size, "big"), int.from_bytes(b"\x5c" * block_size, "big")))
+	for block_size in set(_BLOCK_SIZES.values()))
+
+def _hmac_pad_keys(key, block_size):
+	'''
+	Return the HMAC inner and outer padded keys (K XOR ipad, K XOR opad) for
+	a `key` of at most `block_size` bytes, per RFC 2104.
+	'''
+	ipad, opad = _PADS[block_size]
+	key = int.from_bytes(key, "big") << 8 * (block_size - len(key)) # right pad with zeros
+	return (key ^ ipad).to_bytes(block_size, "big"), (key ^ opad).to_bytes(block_size, "big")
+
+def _blocks_needed(length, hash_len):
+	'''Return the number of HMAC blocks needed to expand to `length` bytes'''
+	if length < 0:
+		raise ValueError("Cannot expand to a negative length (%d bytes)" % length)
+	if length > 255 * hash_len:
+		raise ValueError("Cannot expand to more than 255 * %d = %d bytes using the specified hash function" %\
+			(hash_len, 255 * hash_len))
+	return -(-length // hash_len) # ceil
+
+def _expand_single_block(pseudo_random_key, info, length, hash):
+	'''
+	Fast path for the common L <= HashLen case, e.g. 32 byte keys from SHA-256:
+	T(1) = HMAC(PRK, info | 0x01), with no loop.
+	'''
+	h = hmac.new(pseudo_random_key, None, hash)
+	h.update(info) # like the multi-block path, reject info=None
+	h.update(b"\x01")
+	return h.digest()[:length]
 
 def hkdf_extract(salt, input_key_material, hash=hashlib.sha512):
 	'''
@@ -19,10 +94,37 @@ def hkdf_extract(salt, input_key_material, hash=hashlib.sha512):
 	
 	See the HKDF draft RFC and paper for usage notes.
 	'''
-	hash_len = hash().digest_size
+	hash_len = _digest_size(hash)
 	if salt == None or len(salt) == 0:
-		salt = bytearray((0,) * hash_len)
-	return hmac.new(bytes(salt), buffer(input_key_material), hash).digest()
+		salt = _ZERO_SALTS.get(hash) or bytes(hash_len)
+	# hmac only accepts bytes or bytearray keys, so copy other bytes-like salts
+	if not isinstance(salt, (bytes, bytearray)):
+		salt = bytes(salt)
+	return hmac.new(salt, input_key_material, hash).digest()
+
+@functools.lru_cache(maxsize=1024)
+def _hkdf_extract_cached(salt, input_key_material, hash):
+	return hkdf_extract(salt, input_key_material, hash)
+
+def hkdf_extract_cached(salt, input_key_material, hash=hashlib.sha512):
+	'''
+	Like hkdf_extract, but memoize the pseudorandom key for the most recently
+	used (salt, input_key_material, hash) combinations.
+
+	This keeps copies of the input key material and PRK in memory until they
+	are evicted or hkdf_extract_cached.cache_clear() is called, so only use it
+	where that is acceptable.
+	'''
+	# Copy buffers to hashable bytes for the cache key. memoryview() rejects
+	# ints, which bytes() would silently turn into runs of zero bytes.
+	if salt is not None:
+		salt = bytes(memoryview(salt))
+	if input_key_material is None:
+		input_key_material = b"" # hkdf_extract, via hmac, treats None as empty
+	return _hkdf_extract_cached(salt, bytes(memoryview(input_key_material)), hash)
+
+hkdf_extract_cached.cache_clear = _hkdf_extract_cached.cache_clear
+hkdf_extract_cached.cache_info = _hkdf_extract_cached.cache_info
 
 def hkdf_expand(pseudo_random_key, info=b"", length=32, hash=hashlib.sha512):
 	'''
@@ -30,34 +132,78 @@ def hkdf_expand(pseudo_random_key, info=b"", length=32, hash=hashlib.sha512):
 	HKDF's expand function based on HMAC with the provided hash (default
 	SHA-512). See the HKDF draft RFC and paper for usage notes.
 	'''
-	hash_len = hash().digest_size
+	hash_len = _digest_size(hash)
 	length = int(length)
-	if length > 255 * hash_len:
-		raise Exception("Cannot expand to more than 255 * %d = %d bytes using the specified hash function" %\
-			(hash_len, 255 * hash_len))
-	blocks_needed = length // hash_len + (0 if length % hash_len == 0 else 1) # ceil
-	okm = b""
+	blocks_needed = _blocks_needed(length, hash_len)
+	if blocks_needed == 1:
+		return _expand_single_block(pseudo_random_key, info, length, hash)
+	algorithm = _cryptography_algorithm(hash)
+	if algorithm is not None and length > 0:
+		return HKDFExpand(algorithm=algorithm(), length=length, info=bytes(info),
+			backend=default_backend()).derive(bytes(pseudo_random_key))
+	okm = bytearray(blocks_needed * hash_len)
 	output_block = b""
+	# Key the HMAC once and copy it per block rather than re-deriving the
+	# ipad/opad state for every output block
+	mac = hmac.new(pseudo_random_key, None, hash)
 	for counter in range(blocks_needed):
-		output_block = hmac.new(pseudo_random_key, buffer(output_block + info + bytearray((counter + 1,))),\
-			hash).digest()
-		okm += output_block
-	return okm[:length]
+		h = mac.copy()
+		h.update(output_block)
+		h.update(info)
+		h.update(_CTR8[counter + 1])
+		output_block = h.digest()
+		okm[counter * hash_len:(counter + 1) * hash_len] = output_block
+	return bytes(okm[:length])
+
+def choose_hash(length):
+	'''
+	Suggest a hash function for deriving `length` bytes of output key material.
+
+	Returns hashlib.sha256 for outputs of up to 32 bytes, which need a single
+	HMAC block either way, and hashlib.sha512 for anything longer. SHA-512
+	produces twice the output per HMAC block, halving the number of blocks,
+	and is typically faster per byte than SHA-256 on 64-bit CPUs.
+
+	The same hash must be used for both extract and expand.
+	'''
+	return hashlib.sha256 if length <= 32 else hashlib.sha512
 
 class Hkdf(object):
 	'''
 	Wrapper class for HKDF extract and expand functions
 	'''
-	def __init__(self, salt, input_key_material, hash=hashlib.sha256):
+	def __init__(self, salt, input_key_material, hash=hashlib.sha256, cache=False):
 		'''
 		Extract a pseudorandom key from `salt` and `input_key_material` arguments.
 		
 		See the HKDF draft RFC for guidance on setting these values. The constructor
 		optionally takes a `hash` arugment defining the hash function use,
-		defaulting to hashlib.sha256.
+		defaulting to hashlib.sha256. If `cache` is true, the extract step is
+		memoized via hkdf_extract_cached.
 		'''
 		self._hash = hash
-		self._prk = hkdf_extract(salt, input_key_material, self._hash)
+		extract = hkdf_extract_cached if cache else hkdf_extract
+		self._prk = extract(salt, input_key_material, self._hash)
+		self._init_hash_states()
+	def _init_hash_states(self):
+		'''
+		Set up hash states with the PRK's inner and outer padded keys already
+		absorbed, copied for each output block of every expand() call.
+		'''
+		self._inner = self._outer = None
+		block_size = _BLOCK_SIZES.get(self._hash)
+		if block_size is not None:
+			inner_key, outer_key = _hmac_pad_keys(self._prk, block_size)
+			self._inner = self._hash(inner_key)
+			self._outer = self._hash(outer_key)
+	def __getstate__(self):
+		# hash objects can't be pickled or deep copied; rebuild them from the PRK
+		state = self.__dict__.copy()
+		del state["_inner"], state["_outer"]
+		return state
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._init_hash_states()
 	def expand(self, info=b"", length=32):
 		'''
 		Generate output key material based on an `info` value
@@ -68,5 +214,48 @@ class Hkdf(object):
 
 		See the HKDF draft RFC for guidance.
 		'''
-		return hkdf_expand(self._prk, info, length, self._hash)
+		if self._inner is None:
+			return hkdf_expand(self._prk, info, length, self._hash)
+		hash_len = _digest_size(self._hash)
+		length = int(length)
+		return self._expand(info, length, _blocks_needed(length, hash_len), hash_len)
+	def expand_many(self, infos, length=32):
+		'''
+		Generate output key material for each of several `info` values
+
+		Arguments:
+		- infos - iterable of contexts to generate OKMs for
+		- length - length in bytes of each key to generate
+
+		Returns a list of keys in the same order as `infos`, each equal to
+		the result of `expand(info, length)`.
+		'''
+		if self._inner is None:
+			return [hkdf_expand(self._prk, info, length, self._hash) for info in infos]
+		hash_len = _digest_size(self._hash)
+		length = int(length)
+		blocks_needed = _blocks_needed(length, hash_len)
+		return [self._expand(info, length, blocks_needed, hash_len) for info in infos]
+	def _expand(self, info, length, blocks_needed, hash_len):
+		if blocks_needed == 1:
+			# T(1) = HMAC(PRK, info | 0x01) from the precomputed states, with no
+			# loop or output buffer
+			inner = self._inner.copy()
+			inner.update(info)
+			inner.update(b"\x01")
+			outer = self._outer.copy()
+			outer.update(inner.digest())
+			return outer.digest()[:length]
+		okm = bytearray(blocks_needed * hash_len)
+		output_block = b""
+		for counter in range(blocks_needed):
+			inner = self._inner.copy()
+			inner.update(output_block)
+			inner.update(info)
+			inner.update(_CTR8[counter + 1])
+			outer = self._outer.copy()
+			outer.update(inner.digest())
+			output_block = outer.digest()
+			okm[counter * hash_len:(counter + 1) * hash_len] = output_block
+		return bytes(okm[:length])
 
@@ -1,9 +1,6 @@
 #!/usr/bin/env python
 
-from __future__ import print_function
-
 from setuptools import setup
-import sys
 
 import os
 # Don't use hardlinks while testing from vagrant guest fs
@@ -27,16 +24,15 @@ setup(
 	url="https://github.com/casebeer/python-hkdf",
 
 	py_modules=["hkdf"],
+	python_requires=">=3.3",
 
-	tests_require=["nose"],
-	test_suite="nose.collector",
+	tests_require=["pytest"],
 
 	long_description=readme,
 	classifiers=[
 		"License :: OSI Approved :: BSD License",
 		"Intended Audience :: Developers",
-		"Programming Language :: Python :: 2.6",
-		"Programming Language :: Python :: 2.7",
+		"Programming Language :: Python :: 3 :: Only",
 		"Programming Language :: Python :: 3.3",
 		"Programming Language :: Python :: 3.4",
 	]
@@ -1,57 +1,37 @@
 # coding=utf8
 #
-# Tests for hkdf.py. Run with Nose.
+# Tests for hkdf.py. Run with pytest.
 #
-from __future__ import print_function
-
+import copy
 import hkdf
-import codecs
 import hashlib
-from binascii import hexlify, unhexlify
-import sys
-
-if sys.version_info[0] == 2:
-	from UserDict import IterableUserDict as UserDict
-else:
-	from collections import UserDict
-
-try:
-	from nose.tools import assert_equals
-except ImportError as e:
-	def assert_equals(a, b):
-		'''
-		Assert a and b are equal. 
-		
-		Assume a and b are raw binary data and escape before printing.
-		'''
-		try:
-			assert a == b
-		except AssertionError:
-			print("AssertionError: {a} != {b}".format(a=a.encode("hex"), b=b.encode("hex")))
-			raise
-
-class TestCase(UserDict):
-	'''Pretty print test cases'''
-	def __str__(self):
-		def format_(bytes_, max_len=4):
-			'''Convert byte sequence to shortened hex unicode for printing'''
-			if bytes_ is None:
-				return u"None"
-			else:
-				return u'"{prefix}{rest}"'.format(
-					prefix=hexlify(bytes_[:max_len]),
-					rest=u"..." if len(bytes_) > max_len else u""
-				)
-		return u"""{name} ({algo}, IKM={ikm_start}, salt={salt_start})""".format(
-			name=self.get("name", u"Unnamed test case"),
-			algo=self["hash"]().name,
-			ikm_start=format_(self["IKM"]),
-			salt_start=format_(self["salt"])
-		)
-	__repr__ = __str__
-
-def decode_hex(s):
-	return codecs.decode(s, "hex_codec")
+import hmac
+import math
+import pickle
+from binascii import hexlify
+
+import pytest
+
+def describe_tv(tv):
+	'''Pretty print test vectors'''
+	def format_(bytes_, max_len=4):
+		'''Convert byte sequence to shortened hex for printing'''
+		if bytes_ is None:
+			return "None"
+		else:
+			return '"{prefix}{rest}"'.format(
+				prefix=hexlify(bytes_[:max_len]).decode("ascii"),
+				rest="..." if len(bytes_) > max_len else ""
+			)
+	return "{name} ({algo}, IKM={ikm_start}, salt={salt_start})".format(
+		name=tv.get("name", "Unnamed test case"),
+		algo=tv["hash"]().name,
+		ikm_start=format_(tv["IKM"]),
+		salt_start=format_(tv["salt"])
+	)
+
+def describe_hash(hash):
+	return hash().name
 
 #### HKDF test vectors from draft RFC
 
@@ -60,105 +40,128 @@ test_vectors = {}
 # A.1.  Test Case 1
 # Basic test tv_number with SHA-256
 
-test_vectors[1] = TestCase({
+test_vectors[1] = {
 	"name"  : "A.1 Test Case 1",
 	"hash"  : hashlib.sha256,
-	"IKM"   : decode_hex("0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b"),
-	"salt"  : decode_hex("000102030405060708090a0b0c"),
-	"info"  : decode_hex("f0f1f2f3f4f5f6f7f8f9"),
+	"IKM"   : bytes.fromhex("0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b"),
+	"salt"  : bytes.fromhex("000102030405060708090a0b0c"),
+	"info"  : bytes.fromhex("f0f1f2f3f4f5f6f7f8f9"),
 	"L"     : 42,
-	"PRK"   : decode_hex("077709362c2e32df0ddc3f0dc47bba6390b6c73bb50f9c3122ec844ad7c2b3e5"),
-	"OKM"   : decode_hex("3cb25f25faacd57a90434f64d0362f2a2d2d0a90cf1a5a4c5db02d56ecc4c5bf34007208d5b887185865"),
-})
+	"PRK"   : bytes.fromhex("077709362c2e32df0ddc3f0dc47bba6390b6c73bb50f9c3122ec844ad7c2b3e5"),
+	"OKM"   : bytes.fromhex("3cb25f25faacd57a90434f64d0362f2a2d2d0a90cf1a5a4c5db02d56ecc4c5bf34007208d5b887185865"),
+}
 
 # A.2.  Test Case 2
 # Test with SHA-256 and longer inputs/outputs
 
-test_vectors[2] = TestCase({
+test_vectors[2] = {
 	"name"  : "A.2 Test Case 2",
 	"hash"  : hashlib.sha256,
-	"IKM"   : decode_hex("000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f202122232425262728292a2b2c2d2e2f303132333435363738393a3b3c3d3e3f404142434445464748494a4b4c4d4e4f"),
-	"salt"  : decode_hex("606162636465666768696a6b6c6d6e6f707172737475767778797a7b7c7d7e7f808182838485868788898a8b8c8d8e8f909192939495969798999a9b9c9d9e9fa0a1a2a3a4a5a6a7a8a9aaabacadaeaf"),
-	"info"  : decode_hex("b0b1b2b3b4b5b6b7b8b9babbbcbdbebfc0c1c2c3c4c5c6c7c8c9cacbcccdcecfd0d1d2d3d4d5d6d7d8d9dadbdcdddedfe0e1e2e3e4e5e6e7e8e9eaebecedeeeff0f1f2f3f4f5f6f7f8f9fafbfcfdfeff"),
+	"IKM"   : bytes.fromhex("000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f202122232425262728292a2b2c2d2e2f303132333435363738393a3b3c3d3e3f404142434445464748494a4b4c4d4e4f"),
+	"salt"  : bytes.fromhex("606162636465666768696a6b6c6d6e6f707172737475767778797a7b7c7d7e7f808182838485868788898a8b8c8d8e8f909192939495969798999a9b9c9d9e9fa0a1a2a3a4a5a6a7a8a9aaabacadaeaf"),
+	"info"  : bytes.fromhex("b0b1b2b3b4b5b6b7b8b9babbbcbdbebfc0c1c2c3c4c5c6c7c8c9cacbcccdcecfd0d1d2d3d4d5d6d7d8d9dadbdcdddedfe0e1e2e3e4e5e6e7e8e9eaebecedeeeff0f1f2f3f4f5f6f7f8f9fafbfcfdfeff"),
 	"L"     : 82,
-	"PRK"   : decode_hex("06a6b88c5853361a06104c9ceb35b45cef760014904671014a193f40c15fc244"),
-	"OKM"   : decode_hex("b11e398dc80327a1c8e7f78c596a49344f012eda2d4efad8a050cc4c19afa97c59045a99cac7827271cb41c65e590e09da3275600c2f09b8367793a9aca3db71cc30c58179ec3e87c14c01d5c1f3434f1d87"),
-})
+	"PRK"   : bytes.fromhex("06a6b88c5853361a06104c9ceb35b45cef760014904671014a193f40c15fc244"),
+	"OKM"   : bytes.fromhex("b11e398dc80327a1c8e7f78c596a49344f012eda2d4efad8a050cc4c19afa97c59045a99cac7827271cb41c65e590e09da3275600c2f09b8367793a9aca3db71cc30c58179ec3e87c14c01d5c1f3434f1d87"),
+}
 
 
 # A.3.  Test Case 3
 # Test with SHA-256 and zero-length salt/info
 
-test_vectors[3] = TestCase({
+test_vectors[3] = {
 	"name"  : "A.3 Test Case 3",
 	"hash"  : hashlib.sha256,
-	"IKM"   : decode_hex("0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b"),
+	"IKM"   : bytes.fromhex("0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b"),
 	"salt"  : b"",
 	"info"  : b"",
 	"L"     : 42,
-	"PRK"   : decode_hex("19ef24a32c717b167f33a91d6f648bdf96596776afdb6377ac434c1c293ccb04"),
-	"OKM"   : decode_hex("8da4e775a563c18f715f802a063c5a31b8a11f5c5ee1879ec3454e5f3c738d2d9d201395faa4b61a96c8"),
-})
+	"PRK"   : bytes.fromhex("19ef24a32c717b167f33a91d6f648bdf96596776afdb6377ac434c1c293ccb04"),
+	"OKM"   : bytes.fromhex("8da4e775a563c18f715f802a063c5a31b8a11f5c5ee1879ec3454e5f3c738d2d9d201395faa4b61a96c8"),
+}
 
 # A.4.  Test Case 4
 # Basic test tv_number with SHA-1
 
-test_vectors[4] = TestCase({
+test_vectors[4] = {
 	"name"  : "A.4 Test Case 4",
 	"hash"  : hashlib.sha1,
-	"IKM"   : decode_hex("0b0b0b0b0b0b0b0b0b0b0b"),
-	"salt"  : decode_hex("000102030405060708090a0b0c"),
-	"info"  : decode_hex("f0f1f2f3f4f5f6f7f8f9"),
+	"IKM"   : bytes.fromhex("0b0b0b0b0b0b0b0b0b0b0b"),
+	"salt"  : bytes.fromhex("000102030405060708090a0b0c"),
+	"info"  : bytes.fromhex("f0f1f2f3f4f5f6f7f8f9"),
 	"L"     : 42,
-	"PRK"   : decode_hex("9b6c18c432a7bf8f0e71c8eb88f4b30baa2ba243"),
-	"OKM"   : decode_hex("085a01ea1b10f36933068b56efa5ad81a4f14b822f5b091568a9cdd4f155fda2c22e422478d305f3f896"),
-})
+	"PRK"   : bytes.fromhex("9b6c18c432a7bf8f0e71c8eb88f4b30baa2ba243"),
+	"OKM"   : bytes.fromhex("085a01ea1b10f36933068b56efa5ad81a4f14b822f5b091568a9cdd4f155fda2c22e422478d305f3f896"),
+}
 
 # A.5.  Test Case 5
 # Test with SHA-1 and longer inputs/outputs
 
-test_vectors[5] = TestCase({
+test_vectors[5] = {
 	"name"  : "A.5 Test Case 5",
 	"hash"  : hashlib.sha1,
-	"IKM"   : decode_hex("000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f202122232425262728292a2b2c2d2e2f303132333435363738393a3b3c3d3e3f404142434445464748494a4b4c4d4e4f"),
-	"salt"  : decode_hex("606162636465666768696a6b6c6d6e6f707172737475767778797a7b7c7d7e7f808182838485868788898a8b8c8d8e8f909192939495969798999a9b9c9d9e9fa0a1a2a3a4a5a6a7a8a9aaabacadaeaf"),
-	"info"  : decode_hex("b0b1b2b3b4b5b6b7b8b9babbbcbdbebfc0c1c2c3c4c5c6c7c8c9cacbcccdcecfd0d1d2d3d4d5d6d7d8d9dadbdcdddedfe0e1e2e3e4e5e6e7e8e9eaebecedeeeff0f1f2f3f4f5f6f7f8f9fafbfcfdfeff"),
+	"IKM"   : bytes.fromhex("000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f202122232425262728292a2b2c2d2e2f303132333435363738393a3b3c3d3e3f404142434445464748494a4b4c4d4e4f"),
+	"salt"  : bytes.fromhex("606162636465666768696a6b6c6d6e6f707172737475767778797a7b7c7d7e7f808182838485868788898a8b8c8d8e8f909192939495969798999a9b9c9d9e9fa0a1a2a3a4a5a6a7a8a9aaabacadaeaf"),
+	"info"  : bytes.fromhex("b0b1b2b3b4b5b6b7b8b9babbbcbdbebfc0c1c2c3c4c5c6c7c8c9cacbcccdcecfd0d1d2d3d4d5d6d7d8d9dadbdcdddedfe0e1e2e3e4e5e6e7e8e9eaebecedeeeff0f1f2f3f4f5f6f7f8f9fafbfcfdfeff"),
 	"L"     : 82,
-	"PRK"   : decode_hex("8adae09a2a307059478d309b26c4115a224cfaf6"),
-	"OKM"   : decode_hex("0bd770a74d1160f7c9f12cd5912a06ebff6adcae899d92191fe4305673ba2ffe8fa3f1a4e5ad79f3f334b3b202b2173c486ea37ce3d397ed034c7f9dfeb15c5e927336d0441f4c4300e2cff0d0900b52d3b4"),
-})
+	"PRK"   : bytes.fromhex("8adae09a2a307059478d309b26c4115a224cfaf6"),
+	"OKM"   : bytes.fromhex("0bd770a74d1160f7c9f12cd5912a06ebff6adcae899d92191fe4305673ba2ffe8fa3f1a4e5ad79f3f334b3b202b2173c486ea37ce3d397ed034c7f9dfeb15c5e927336d0441f4c4300e2cff0d0900b52d3b4"),
+}
 
 # A.6.  Test Case 6
 # Test with SHA-1 and zero-length salt/info
 
-test_vectors[6] = TestCase({
+test_vectors[6] = {
 	"name"  : "A.6 Test Case 6",
 	"hash"  : hashlib.sha1,
-	"IKM"   : decode_hex("0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b"),
+	"IKM"   : bytes.fromhex("0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b0b"),
 	"salt"  : b"",
 	"info"  : b"",
 	"L"     : 42,
-	"PRK"   : decode_hex("da8c8a73c7fa77288ec6f5e7c297786aa0d32d01"),
-	"OKM"   : decode_hex("0ac1af7002b3d761d1e55298da9d0506b9ae52057220a306e07b6b87e8df21d0ea00033de03984d34918"),
-})
+	"PRK"   : bytes.fromhex("da8c8a73c7fa77288ec6f5e7c297786aa0d32d01"),
+	"OKM"   : bytes.fromhex("0ac1af7002b3d761d1e55298da9d0506b9ae52057220a306e07b6b87e8df21d0ea00033de03984d34918"),
+}
 
 # A.7.  Test Case 7
 # Test with SHA-1, salt not provided (defaults to HashLen zero octets),
 # zero-length info
 
-test_vectors[7] = TestCase({
+test_vectors[7] = {
 	"name"  : "A.7 Test Case 7",
 	"hash"  : hashlib.sha1,
-	"IKM"   : decode_hex("0c0c0c0c0c0c0c0c0c0c0c0c0c0c0c0c0c0c0c0c0c0c"),
+	"IKM"   : bytes.fromhex("0c0c0c0c0c0c0c0c0c0c0c0c0c0c0c0c0c0c0c0c0c0c"),
 	"salt"  : None,
 	"info"  : b"",
 	"L"     : 42,
-	"PRK"   : decode_hex("2adccada18779e7c2077ad2eb19d3f3e731385dd"),
-	"OKM"   : decode_hex("2c91117204d745f3500d636a62f64f0ab3bae548aa53d423b0d1f27ebba6f5e5673a081d70cce7acfc48"),
-})
+	"PRK"   : bytes.fromhex("2adccada18779e7c2077ad2eb19d3f3e731385dd"),
+	"OKM"   : bytes.fromhex("2c91117204d745f3500d636a62f64f0ab3bae548aa53d423b0d1f27ebba6f5e5673a081d70cce7acfc48"),
+}
 
 #### test helpers
 
+class CountingHash(object):
+	'''Wrap a hashlib constructor, counting digest() calls across all copies'''
+	def __init__(self, hash):
+		self.hash = hash
+		self.digests = 0
+	def __call__(self, data=b""):
+		return CountingHashObject(self, self.hash(data))
+
+class CountingHashObject(object):
+	def __init__(self, counter, hash_obj):
+		self._counter = counter
+		self._hash_obj = hash_obj
+		self.name = hash_obj.name
+		self.digest_size = hash_obj.digest_size
+		self.block_size = hash_obj.block_size
+	def update(self, data):
+		self._hash_obj.update(data)
+	def copy(self):
+		return CountingHashObject(self._counter, self._hash_obj.copy())
+	def digest(self):
+		self._counter.digests += 1
+		return self._hash_obj.digest()
+
 def tv_extract(tv_number):
 	tv = test_vectors[tv_number]
 	return hkdf.hkdf_extract(tv["salt"], tv["IKM"], tv["hash"])
@@ -168,50 +171,187 @@ def tv_expand(tv_number):
 	test_prk = hkdf.hkdf_extract(tv["salt"], tv["IKM"], tv["hash"])
 	return hkdf.hkdf_expand(test_prk, tv["info"], tv["L"], tv["hash"])
 
-#### Nose test functions
+@pytest.fixture(params=[
+	"python",
+	pytest.param("cryptography", marks=pytest.mark.skipif(hkdf.HKDFExpand is None,
+		reason="cryptography is not installed")),
+])
+def backend(request, monkeypatch):
+	'''Run a test with each available expand backend'''
+	monkeypatch.setattr(hkdf, "use_cryptography", request.param == "cryptography")
+	return request.param
 
-def test_functional_interface():
-	for tv in test_vectors.values():
-		yield check_fun_tv, tv
+#### test functions
 
-def test_wrapper_class():
-	for tv in test_vectors.values():
-		yield check_class_tv, tv
+tv_params = pytest.mark.parametrize("tv", list(test_vectors.values()), ids=describe_tv)
 
-def check_fun_tv(tv):
+@tv_params
+def test_functional_interface(tv, backend):
 	'''
 	Generate and check HKDF pseudorandom key and output key material for a specific test vector
 	
 	PRK = HKDF-Extract([test vector values])
 	OKM = HKDF-Expand(PRK, [test vector values])
 	'''
-
 	test_prk = hkdf.hkdf_extract(tv["salt"], tv["IKM"], tv["hash"])
 	test_okm = hkdf.hkdf_expand(test_prk, tv["info"], tv["L"], tv["hash"])
-	print("%s" % tv)
-	print("PRK: %s" % ("match" if test_prk == tv["PRK"] else "FAIL"))
-	print("OKM: %s" % ("match" if test_okm == tv["OKM"] else "FAIL"))
-	print
 
-	assert_equals(test_prk, tv["PRK"])
-	assert_equals(test_okm, tv["OKM"])
+	assert test_prk == tv["PRK"]
+	assert test_okm == tv["OKM"]
 
-def check_class_tv(tv):
+@tv_params
+def test_wrapper_class(tv):
 	'''Test HKDF output via wrapper class'''
-
 	kdf = hkdf.Hkdf(tv["salt"], tv["IKM"], tv["hash"])
 	test_okm = kdf.expand(tv["info"], tv["L"])
 
-	print("%s (via wrapper class)" % tv)
-	print("PRK: %s" % ("match" if kdf._prk == tv["PRK"] else "FAIL"))
-	print("OKM: %s" % ("match" if test_okm == tv["OKM"] else "FAIL"))
-	print()
+	assert kdf._prk == tv["PRK"]
+	assert test_okm == tv["OKM"]
 
-	assert_equals(kdf._prk, tv["PRK"])
-	assert_equals(test_okm, tv["OKM"])
+@tv_params
+def test_wrapper_class_expand_many(tv):
+	'''Test batched HKDF output via wrapper class'''
+	kdf = hkdf.Hkdf(tv["salt"], tv["IKM"], tv["hash"])
+	test_okms = kdf.expand_many([tv["info"], b"other info"], tv["L"])
 
-if __name__ == "__main__":
-	for f, tv in test_functional_interface():
-		f(tv)
-	for f, tv in test_wrapper_class():
-		f(tv)
+	assert len(test_okms) == 2
+	assert test_okms[0] == tv["OKM"]
+	assert test_okms[1] == kdf.expand(b"other info", tv["L"])
+
+@tv_params
+def test_wrapper_class_pickle(tv):
+	'''Test that wrapper class instances survive pickling and deep copying'''
+	kdf = hkdf.Hkdf(tv["salt"], tv["IKM"], tv["hash"])
+	for copied in (pickle.loads(pickle.dumps(kdf)), copy.deepcopy(kdf)):
+		assert copied._prk == tv["PRK"]
+		assert copied.expand(tv["info"], tv["L"]) == tv["OKM"]
+
+@tv_params
+def test_extract_cached(tv):
+	'''Test cached extract against a test vector, then hit the cache'''
+	hkdf.hkdf_extract_cached.cache_clear()
+	assert hkdf.hkdf_extract_cached(tv["salt"], tv["IKM"], tv["hash"]) == tv["PRK"]
+	salt = None if tv["salt"] is None else bytearray(tv["salt"])
+	assert hkdf.hkdf_extract_cached(salt, bytearray(tv["IKM"]), tv["hash"]) == tv["PRK"]
+	assert hkdf.hkdf_extract_cached.cache_info().hits == 1
+
+	kdf = hkdf.Hkdf(tv["salt"], tv["IKM"], tv["hash"], cache=True)
+	assert kdf.expand(tv["info"], tv["L"]) == tv["OKM"]
+	assert hkdf.hkdf_extract_cached.cache_info().hits == 2
+	hkdf.hkdf_extract_cached.cache_clear()
+
+def test_extract_cached_rejects_ints():
+	'''Check that ints aren't silently turned into zero-filled salts or IKM'''
+	with pytest.raises(TypeError):
+		hkdf.hkdf_extract_cached(3, b"input key material")
+	with pytest.raises(TypeError):
+		hkdf.hkdf_extract_cached(b"salt", 32)
+
+def test_extract_cached_none_ikm():
+	'''Check that cached extract accepts None input key material like hkdf_extract'''
+	expected = hkdf.hkdf_extract(b"salt", None, hashlib.sha256)
+	assert hkdf.hkdf_extract_cached(b"salt", None, hashlib.sha256) == expected
+	assert hkdf.Hkdf(b"salt", None, cache=True)._prk == expected
+	hkdf.hkdf_extract_cached.cache_clear()
+
+@pytest.mark.parametrize("salt", [None, b""], ids=["None", "empty"])
+@pytest.mark.parametrize("hash", [hashlib.sha1, hashlib.sha256, hashlib.sha512], ids=describe_hash)
+def test_extract_default_salt(hash, salt):
+	'''Check that a missing salt is replaced by HashLen zero octets, per the RFC'''
+	ikm = b"input key material"
+	expected = hmac.new(b"\0" * hash().digest_size, ikm, hash).digest()
+	assert hkdf.hkdf_extract(salt, ikm, hash) == expected
+
+def test_extract_none_ikm():
+	'''Check that None input key material is treated like the empty string, as hmac does'''
+	assert hkdf.hkdf_extract(b"salt", None, hashlib.sha256) == hkdf.hkdf_extract(b"salt", b"", hashlib.sha256)
+
+@pytest.mark.parametrize("salt_len", [16, 200])
+@pytest.mark.parametrize("hash", [hashlib.sha256, hashlib.sha512], ids=describe_hash)
+def test_extract_bytes_like_salt(hash, salt_len):
+	'''Check that bytearray and memoryview salts extract the same PRK as bytes'''
+	salt = bytes(range(salt_len))
+	ikm = b"input key material"
+	expected = hkdf.hkdf_extract(salt, ikm, hash)
+	assert hkdf.hkdf_extract(bytearray(salt), ikm, hash) == expected
+	assert hkdf.hkdf_extract(memoryview(salt), ikm, hash) == expected
+
+@pytest.mark.parametrize("hash, length", [
+	(hash, length)
+	for hash in (hashlib.sha256, hashlib.sha512)
+	for length in (hash().digest_size, 2 * hash().digest_size, 32, 64)
+])
+def test_expand_block_count(hash, length, backend):
+	'''
+	Check that expand computes exactly ceil(L / HashLen) HMAC blocks, without
+	an extra, discarded block when L is a multiple of HashLen
+	'''
+	prk = hkdf.hkdf_extract(None, b"input key material", hash)
+	counting_hash = CountingHash(hash)
+	test_okm = hkdf.hkdf_expand(prk, b"info", length, counting_hash)
+	blocks_needed = math.ceil(length / hash().digest_size)
+
+	# each HMAC block finalizes both the inner and the outer hash
+	assert counting_hash.digests == 2 * blocks_needed
+	# the counting hash always takes the pure Python path; compare it with the
+	# backend under test and with the wrapper class
+	assert test_okm == hkdf.hkdf_expand(prk, b"info", length, hash)
+	kdf = hkdf.Hkdf(None, b"input key material", hash)
+	assert kdf.expand(b"info", length) == test_okm
+	assert kdf.expand_many([b"info"], length) == [test_okm]
+
+@pytest.mark.parametrize("hash, length", [
+	(hash, length)
+	for hash in (hashlib.sha1, hashlib.sha256, hashlib.sha512)
+	for length in (1, 16, hash().digest_size)
+])
+def test_expand_single_block(hash, length):
+	'''Check single block output against the prefix of a multi-block expand'''
+	prk = hkdf.hkdf_extract(None, b"input key material", hash)
+	longer_okm = hkdf.hkdf_expand(prk, b"info", hash().digest_size + 1, hash)
+	assert hkdf.hkdf_expand(prk, b"info", length, hash) == longer_okm[:length]
+	kdf = hkdf.Hkdf(None, b"input key material", hash)
+	assert kdf.expand(b"info", length) == longer_okm[:length]
+	assert kdf.expand_many([b"info"], length) == [longer_okm[:length]]
+
+@pytest.mark.parametrize("length", [-1, -40])
+def test_expand_negative_length(length, backend):
+	'''Check that negative lengths are rejected with ValueError'''
+	prk = hkdf.hkdf_extract(None, b"input key material", hashlib.sha256)
+	kdf = hkdf.Hkdf(None, b"input key material", hashlib.sha256)
+	with pytest.raises(ValueError):
+		hkdf.hkdf_expand(prk, b"x", length, hashlib.sha256)
+	with pytest.raises(ValueError):
+		kdf.expand(b"x", length)
+	with pytest.raises(ValueError):
+		kdf.expand_many([b"x"], length)
+	assert hkdf.hkdf_expand(prk, b"x", 0, hashlib.sha256) == b""
+	assert kdf.expand(b"x", 0) == b""
+
+@pytest.mark.parametrize("length", [16, 64])
+def test_expand_rejects_none_info(length):
+	'''Check that info=None is rejected for single and multi-block outputs alike'''
+	prk = hkdf.hkdf_extract(None, b"input key material", hashlib.sha256)
+	kdf = hkdf.Hkdf(None, b"input key material", hashlib.sha256)
+	with pytest.raises(TypeError):
+		hkdf.hkdf_expand(prk, None, length, hashlib.sha256)
+	with pytest.raises(TypeError):
+		kdf.expand(None, length)
+
+@pytest.mark.parametrize("hash", [hashlib.sha1, hashlib.sha256, hashlib.sha512], ids=describe_hash)
+def test_expand_length_limit(hash):
+	'''Check that expanding to more than 255 * HashLen bytes is rejected before any HMAC is computed'''
+	prk = hkdf.hkdf_extract(None, b"input key material", hash)
+	max_length = 255 * hash().digest_size
+	assert len(hkdf.hkdf_expand(prk, b"", max_length, hash)) == max_length
+
+	counting_hash = CountingHash(hash)
+	with pytest.raises(ValueError):
+		hkdf.hkdf_expand(prk, b"", max_length + 1, counting_hash)
+	assert counting_hash.digests == 0
+
+def test_choose_hash():
+	assert hkdf.choose_hash(16) is hashlib.sha256
+	assert hkdf.choose_hash(32) is hashlib.sha256
+	assert hkdf.choose_hash(33) is hashlib.sha512
+	assert hkdf.choose_hash(255 * 64) is hashlib.sha512